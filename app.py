@@ -13,15 +13,24 @@ Flask PPTX exporter (final)
 - NEW: bottom phrase is reflowed so every 5 words starts a new line (keeps formatting).
 """
 
+import io
+import multiprocessing
 import os
 import re
-import uuid
-import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from copy import deepcopy
+from xml.sax.saxutils import escape
 from flask import Flask, render_template, request, send_file, abort
 from pptx import Presentation
 from pptx.util import Pt, Inches
 from pptx.dml.color import RGBColor
 from pptx.enum.text import PP_ALIGN
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls, qn
+from lxml import etree
 
 # new import for safe filenames
 from werkzeug.utils import secure_filename
@@ -49,6 +58,22 @@ FORMATS = {
     }
 }
 
+# precompiled patterns for the per-line text path
+_CTRL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]+")
+_LEAD_RE = re.compile(r"^[\t\u00A0\u200b\ufeff]+")
+_WORDS_RE = re.compile(r"\S+")
+
+# single-pass substitutions for sanitize_line: drop tabs/CR/zero-width/BOM, NBSP -> space
+_TRANS = str.maketrans({"\t": "", "\r": "", "\u00A0": " ", "\u200b": "", "\ufeff": ""})
+
+# length/color values reused on every slide, built once
+_ZERO_IN = Inches(0)
+_ZERO_PT = Pt(0)
+_FOOTER_FONT_SIZE = Pt(14)
+_DOT_FONT_SIZE = Pt(28)
+_WHITE = RGBColor(255, 255, 255)
+_RED = RGBColor(255, 0, 0)
+
 # -----------------------
 # Helpers
 # -----------------------
@@ -60,14 +85,40 @@ def hex_to_rgb_tuple(hex_color):
         return (0, 0, 0)
     return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
 
+# folder listings, re-scanned only when the folder's mtime changes
+_TEMPLATES_CACHE = {"mtime": 0, "files": []}
+_IMAGES_CACHE = {"mtime": 0, "files": []}
+
 def ensure_templates():
-    files = []
-    if not os.path.isdir(TEMPLATES_FOLDER):
-        return files
-    for f in os.listdir(TEMPLATES_FOLDER):
-        if f.lower().endswith(".pptx"):
-            files.append(f)
-    return sorted(files)
+    """Sorted .pptx filenames in TEMPLATES_FOLDER (cached; do not mutate the result)."""
+    try:
+        st = os.stat(TEMPLATES_FOLDER)
+    except OSError:
+        return []
+    if st.st_mtime == _TEMPLATES_CACHE["mtime"]:
+        return _TEMPLATES_CACHE["files"]
+    files = [f for f in os.listdir(TEMPLATES_FOLDER) if f.lower().endswith(".pptx")]
+    files.sort()
+    _TEMPLATES_CACHE["files"] = files
+    _TEMPLATES_CACHE["mtime"] = st.st_mtime
+    return files
+
+def list_template_images():
+    """Sorted thumbnail filenames in static/images, excluding quran (cached like ensure_templates)."""
+    images_dir = os.path.join(STATIC_FOLDER, "images")
+    try:
+        st = os.stat(images_dir)
+    except OSError:
+        return []
+    if st.st_mtime == _IMAGES_CACHE["mtime"]:
+        return _IMAGES_CACHE["files"]
+    images = []
+    for f in sorted(os.listdir(images_dir)):
+        if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp")) and os.path.splitext(f)[0].lower() != "quran":
+            images.append(f)
+    _IMAGES_CACHE["files"] = images
+    _IMAGES_CACHE["mtime"] = st.st_mtime
+    return images
 
 def find_matching_template_for_image(image_basename, pptx_list):
     base = image_basename.lower()
@@ -79,23 +130,53 @@ def find_matching_template_for_image(image_basename, pptx_list):
         return candidate
     return None
 
+# index-page data; rebuilt only when either cached folder listing changes
+_GALLERY_CACHE = {"pptx": None, "images": None, "gallery": ([], [], {})}
+
+def template_gallery():
+    """
+    Return (available_templates, images, image_to_template) for the index page.
+    Quran is excluded; the image -> template matching runs only after a listing changed.
+    """
+    all_pptx = ensure_templates()
+    images = list_template_images()
+    if _GALLERY_CACHE["pptx"] is all_pptx and _GALLERY_CACHE["images"] is images:
+        return _GALLERY_CACHE["gallery"]
+
+    available_templates = [p for p in all_pptx if os.path.splitext(p)[0].lower() != "quran"]
+    # build a mapping image -> matched template filename (if found)
+    image_to_template = {}
+    for img in images:
+        base = os.path.splitext(img)[0]
+        image_to_template[img] = find_matching_template_for_image(base, available_templates)
+
+    gallery = (available_templates, images, image_to_template)
+    _GALLERY_CACHE["gallery"] = gallery
+    _GALLERY_CACHE["pptx"] = all_pptx
+    _GALLERY_CACHE["images"] = images
+    return gallery
+
 def copy_font_attrs(src_run, dst_run):
     """Copy basic font attributes from src_run to dst_run if present."""
     try:
         font = src_run.font
-        if getattr(font, "name", None):
-            dst_run.font.name = font.name
-        if getattr(font, "size", None):
-            dst_run.font.size = font.size
-        if getattr(font, "bold", None) is not None:
-            dst_run.font.bold = font.bold
-        if getattr(font, "italic", None) is not None:
-            dst_run.font.italic = font.italic
-        try:
-            if font.color and getattr(font.color, "rgb", None):
-                dst_run.font.color.rgb = font.color.rgb
-        except Exception:
-            pass
+        dst_font = dst_run.font
+        name = font.name
+        if name:
+            dst_font.name = name
+        size = font.size
+        if size:
+            dst_font.size = size
+        bold = font.bold
+        if bold is not None:
+            dst_font.bold = bold
+        italic = font.italic
+        if italic is not None:
+            dst_font.italic = italic
+        # .rgb raises AttributeError for non-RGB (none/theme/system) colors
+        rgb = getattr(font.color, "rgb", None)
+        if rgb is not None:
+            dst_font.color.rgb = rgb
     except Exception:
         pass
 
@@ -118,51 +199,79 @@ def apply_fmt_to_run(run, fmt):
         r, g, b = hex_to_rgb_tuple(fmt["color"])
         run.font.color.rgb = RGBColor(r, g, b)
 
+def resolve_fmt(fmt):
+    """
+    Turn a FORMATS role entry (e.g. FORMATS["marsiya"]["Top"]) into ready-to-assign
+    font values: {"name", "size": Pt, "bold", "italic", "rgb": RGBColor}.
+    Done once per template so the per-run code does no size/hex parsing.
+    """
+    if not fmt:
+        return None
+    resolved = {}
+    if fmt.get("font"):
+        resolved["name"] = fmt["font"]
+    if fmt.get("size"):
+        try:
+            resolved["size"] = Pt(int(fmt["size"]))
+        except Exception:
+            pass
+    if fmt.get("bold") is not None:
+        resolved["bold"] = bool(fmt["bold"])
+    if fmt.get("italic") is not None:
+        resolved["italic"] = bool(fmt["italic"])
+    if fmt.get("color"):
+        resolved["rgb"] = RGBColor(*hex_to_rgb_tuple(fmt["color"]))
+    return resolved
+
+# FORMATS with every role already resolved (Pt sizes, RGBColor colors), built once at import
+RESOLVED_FORMATS = {
+    key: {role: resolve_fmt(fmt) for role, fmt in roles.items()}
+    for key, roles in FORMATS.items()
+}
+
 def apply_fmt_respecting_template(run, fmt):
     """
-    Apply fmt to run, but do NOT override attributes already present on the run (template wins).
+    Apply fmt (as returned by resolve_fmt) to run, but do NOT override attributes
+    already present on the run (template wins).
     Only sets properties that are missing/None on the run's font.
     """
     if not fmt:
         return
     font = run.font
-    # font name: apply only if template doesn't provide one
-    try:
-        if fmt.get("font") and not getattr(font, "name", None):
-            font.name = fmt["font"]
-    except Exception:
-        pass
-
-    # size: apply only if not present
-    try:
-        if fmt.get("size") and getattr(font, "size", None) is None:
-            font.size = Pt(int(fmt["size"]))
-    except Exception:
-        pass
 
-    # bold: apply only if template left it unset (None)
-    try:
-        if fmt.get("bold") is not None and getattr(font, "bold", None) is None:
-            font.bold = bool(fmt["bold"])
-    except Exception:
-        pass
-
-    # italic
-    try:
-        if fmt.get("italic") is not None and getattr(font, "italic", None) is None:
-            font.italic = bool(fmt["italic"])
-    except Exception:
-        pass
+    # font name / size: apply only if template doesn't provide one
+    name = fmt.get("name")
+    if name and not font.name:
+        font.name = name
+    size = fmt.get("size")
+    if size and font.size is None:
+        font.size = size
+
+    # bold / italic: apply only if template left it unset (None)
+    bold = fmt.get("bold")
+    if bold is not None and font.bold is None:
+        font.bold = bold
+    italic = fmt.get("italic")
+    if italic is not None and font.italic is None:
+        font.italic = italic
 
     # color: only set if there is no existing rgb color
+    rgb = fmt.get("rgb")
+    if rgb is not None and getattr(font.color, "rgb", None) is None:
+        font.color.rgb = rgb
+
+def style_run(run, src_run_sample=None, override_fmt=None):
+    """
+    Format a freshly written run: copy the template sample run's attributes (if any),
+    then apply override_fmt only where the template didn't provide the attribute.
+    """
+    if src_run_sample:
+        try:
+            copy_font_attrs(src_run_sample, run)
+        except Exception:
+            pass
     try:
-        if fmt.get("color"):
-            existing_rgb = None
-            if getattr(font, "color", None) and getattr(font.color, "rgb", None):
-                existing_rgb = font.color.rgb
-            if existing_rgb is None:
-                r, g, b = hex_to_rgb_tuple(fmt["color"])
-                font.color.rgb = RGBColor(r, g, b)
+        apply_fmt_respecting_template(run, override_fmt)
     except Exception:
         pass
 
@@ -190,10 +299,10 @@ def reset_paragraph_format(paragraph):
     try:
         pf = paragraph.paragraph_format
         # zero out indents and spacing
-        pf.left_indent = Pt(0)
-        pf.first_line_indent = Pt(0)
-        pf.space_before = Pt(0)
-        pf.space_after = Pt(0)
+        pf.left_indent = _ZERO_PT
+        pf.first_line_indent = _ZERO_PT
+        pf.space_before = _ZERO_PT
+        pf.space_after = _ZERO_PT
         # ensure paragraph is top-level (no bullet/level-based indent)
         try:
             paragraph.level = 0
@@ -208,6 +317,21 @@ def reset_paragraph_format(paragraph):
     except Exception:
         pass
 
+def _zero_margins(tf):
+    """
+    Zero all four text-frame insets (template-inherited padding/indentation) by writing
+    the <a:bodyPr> attributes directly instead of four margin_* property assignments.
+    """
+    txBody = tf._txBody
+    bodyPr = txBody.find(qn("a:bodyPr"))
+    if bodyPr is None:
+        bodyPr = txBody.makeelement(qn("a:bodyPr"), {})
+        txBody.insert(0, bodyPr)
+    bodyPr.set("lIns", "0")
+    bodyPr.set("rIns", "0")
+    bodyPr.set("tIns", "0")
+    bodyPr.set("bIns", "0")
+
 def sanitize_line(line, strip_leading_spaces=True):
     """
     Remove problematic characters that can produce tabs/indentation in the PPTX.
@@ -216,19 +340,17 @@ def sanitize_line(line, strip_leading_spaces=True):
     """
     if line is None:
         return ""
-    s = line
-    # remove explicit tabs
-    s = s.replace("\t", "")
-    # remove carriage returns (we split on \n elsewhere)
-    s = s.replace("\r", "")
-    # normalize NBSP to normal space
-    s = s.replace("\u00A0", " ")
-    # remove zero-width and BOM characters
-    s = s.replace("\u200b", "").replace("\ufeff", "")
+    # fast path: isprintable() is False for tabs, CR/LF, NBSP, zero-width/BOM and
+    # control characters, so a printable line has nothing to translate or strip
+    if line.isprintable():
+        return line.lstrip() if strip_leading_spaces else line
+    # remove tabs, carriage returns (we split on \n elsewhere), zero-width and BOM
+    # characters and normalize NBSP to normal space - all in one pass
+    s = line.translate(_TRANS)
     # remove remaining ASCII control characters (except newline if present)
-    s = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f]+", "", s)
+    s = _CTRL_RE.sub("", s)
     # remove leading tab-like / NBSP / ZWSP leftover at start
-    s = re.sub(r"^[\t\u00A0\u200b\ufeff]+", "", s)
+    s = _LEAD_RE.sub("", s)
     # optionally remove normal leading spaces too (Google Slides collapses them)
     if strip_leading_spaces:
         s = s.lstrip()
@@ -246,16 +368,9 @@ def break_every_n_words(text, n=5):
     - Keeps punctuation attached to words.
     - Collapses existing whitespace and joins across original newlines.
     """
-    if not text:
-        return ""
     # take tokens separated by whitespace
-    words = re.findall(r"\S+", text)
-    if not words:
-        return ""
-    lines = []
-    for i in range(0, len(words), n):
-        lines.append(" ".join(words[i:i + n]))
-    return "\n".join(lines)
+    words = _WORDS_RE.findall(text or "")
+    return "\n".join(" ".join(words[i:i + n]) for i in range(0, len(words), n))
 
 # -----------------------
 # Normalization helper (programmatic Slide Master edit)
@@ -265,25 +380,22 @@ def normalize_template_placeholders(prs):
     Walk slide masters, layouts and the first slide to normalize any placeholder
     text frames so template-level indents/margins/bullet levels do not carry over.
     This is a best-effort programmatic substitute for 'Edit Slide Master'.
+    Runs once per template file (see load_template_presentation), not per request.
     """
-    def _normalize_shape(sh):
-        if not hasattr(sh, "text_frame") or sh.text_frame is None:
+    def _normalize_shape(sh, sanitize_runs=True):
+        if not sh.has_text_frame:
             return
         try:
             tf = sh.text_frame
             # Zero margins on placeholder text frames
-            try:
-                tf.margin_left = Inches(0)
-                tf.margin_right = Inches(0)
-                tf.margin_top = Inches(0)
-                tf.margin_bottom = Inches(0)
-            except Exception:
-                pass
+            _zero_margins(tf)
 
             # Ensure paragraphs are reset and runs sanitized
             try:
                 for p in tf.paragraphs:
                     reset_paragraph_format(p)
+                    if not sanitize_runs:
+                        continue
                     for r in p.runs:
                         try:
                             r.text = sanitize_line(r.text)
@@ -302,11 +414,12 @@ def normalize_template_placeholders(prs):
     except Exception:
         pass
 
-    # Normalize layouts
+    # Normalize layouts (formatting only: layout text is static template content and
+    # placeholder prompt text is never copied onto generated slides)
     try:
         for layout in prs.slide_layouts:
             for sh in layout.shapes:
-                _normalize_shape(sh)
+                _normalize_shape(sh, sanitize_runs=False)
     except Exception:
         pass
 
@@ -318,6 +431,53 @@ def normalize_template_placeholders(prs):
     except Exception:
         pass
 
+# -----------------------
+# Template cache
+# -----------------------
+def drop_unlisted_slide_rels(prs):
+    """
+    Drop slide relationships that no <p:sldId> references any more. Their parts would
+    otherwise still be saved, and python-pptx renumbers listed slides from slide1.xml
+    without looking at them, so the saved package can end up with duplicate partnames.
+    """
+    listed = {sldId.rId for sldId in prs.part._element.get_or_add_sldIdLst()}
+    for rId, rel in list(prs.part.rels.items()):
+        if rel.reltype == RT.SLIDE and rId not in listed:
+            prs.part.drop_rel(rId)
+
+# template_path -> (mtime, bytes of the already-normalized template)
+_TEMPLATE_BYTES_CACHE: dict[str, tuple[float, bytes]] = {}
+_TEMPLATE_CACHE_LOCK = threading.Lock()
+
+def load_template_presentation(template_path):
+    """
+    Return a fresh Presentation for template_path.
+    The template is read, normalized and re-serialized once per file mtime;
+    later calls only re-open the cached bytes, skipping the unzip + normalization walk.
+    """
+    mtime = os.stat(template_path).st_mtime
+    with _TEMPLATE_CACHE_LOCK:
+        cached = _TEMPLATE_BYTES_CACHE.get(template_path)
+        if cached is None or cached[0] != mtime:
+            with open(template_path, "rb") as f:
+                prs = Presentation(io.BytesIO(f.read()))
+            # templates saved from an earlier export can still carry the removed template slide
+            try:
+                drop_unlisted_slide_rels(prs)
+            except Exception:
+                pass
+            # normalize placeholders/layouts/slide-master so indent/bullets don't leak in
+            try:
+                normalize_template_placeholders(prs)
+            except Exception:
+                # non-fatal: continue even if normalization fails
+                pass
+            buf = io.BytesIO()
+            prs.save(buf)
+            cached = (mtime, buf.getvalue())
+            _TEMPLATE_BYTES_CACHE[template_path] = cached
+    return Presentation(io.BytesIO(cached[1]))
+
 # -----------------------
 # Helpers to write each line as paragraphs or explicit breaks
 # -----------------------
@@ -325,21 +485,14 @@ def write_lines_to_textframe_preserve_style(text_frame, text, src_run_sample=Non
     """
     Write text into text_frame.
     - If use_paragraphs is False: uses single paragraph + explicit run breaks (original behavior).
-    - If use_paragraphs is True: writes all lines into the text_frame.text using '\n'.join,
-      letting python-pptx turn each '\n' into a new paragraph.
+    - If use_paragraphs is True: writes each line as its own paragraph.
     Leading spaces are stripped (by default) to avoid Google Slides collapsing lines.
     """
     # Clear existing content first
     text_frame.clear()
 
     # Zero text-frame margins to avoid template-inherited padding/indentation.
-    try:
-        text_frame.margin_left = Inches(0)
-        text_frame.margin_right = Inches(0)
-        text_frame.margin_top = Inches(0)
-        text_frame.margin_bottom = Inches(0)
-    except Exception:
-        pass
+    _zero_margins(text_frame)
 
     # Build lines list - preserve empty lines as empty visual lines
     lines = (text or "").splitlines()
@@ -349,75 +502,43 @@ def write_lines_to_textframe_preserve_style(text_frame, text, src_run_sample=Non
     # sanitize lines
     lines = [sanitize_line(ln, strip_leading_spaces=True) for ln in lines]
 
+    # Resolve paragraph and run properties once, through python-pptx, on the frame's
+    # first paragraph; every line then gets a copy of that <a:pPr>/<a:rPr> and the
+    # <a:p>/<a:r>/<a:t> elements are built directly as XML.
+    p = text_frame.paragraphs[0]
+    reset_paragraph_format(p)
+    if align is not None:
+        set_paragraph_alignment(p, align)
+    proto_run = p.add_run()
+    style_run(proto_run, src_run_sample, override_fmt)
+    a_p = p._p
+    pPr = a_p.pPr
+    rPr = proto_run._r.rPr
+    a_p.remove(proto_run._r)
+
     if use_paragraphs:
-        # Simple approach: set the whole text to newline-joined sanitized lines.
-        # python-pptx will convert each '\n' to a separate paragraph.
-        try:
-            text_frame.text = "\n".join(lines)
-        except Exception:
-            # fallback - manually add paragraphs
-            text_frame.clear()
-            for i, ln in enumerate(lines):
-                if i == 0:
-                    p = text_frame.paragraphs[0]
-                    p.text = ln or ""
-                else:
-                    p = text_frame.add_paragraph()
-                    p.text = ln or ""
+        # One paragraph per line (empty lines stay as empty paragraphs, no run).
+        # All paragraphs are serialized into one string, parsed once and swapped in for
+        # the frame's <a:p> children in a single slice assignment.
+        pPr_xml = etree.tostring(pPr, encoding="unicode") if pPr is not None else ""
+        rPr_xml = etree.tostring(rPr, encoding="unicode") if rPr is not None else ""
+        paragraphs_xml = "".join(
+            "<a:p>%s%s</a:p>" % (pPr_xml, "<a:r>%s<a:t>%s</a:t></a:r>" % (rPr_xml, escape(line)) if line else "")
+            for line in lines
+        )
+        new_body = parse_xml("<a:txBody %s>%s</a:txBody>" % (nsdecls("a"), paragraphs_xml))
+        txBody = text_frame._txBody
+        txBody[txBody.index(a_p):] = list(new_body)
     else:
         # Single paragraph with explicit breaks between runs (original behavior)
-        p = text_frame.paragraphs[0]
-        reset_paragraph_format(p)
-        if align is not None:
-            set_paragraph_alignment(p, align)
-
-        prev_run = None
-        for raw_line in lines:
-            line = sanitize_line(raw_line, strip_leading_spaces=True)
-            run = p.add_run()
-            if prev_run is not None:
-                try:
-                    prev_run.add_break()
-                except Exception:
-                    try:
-                        prev_run.text = (prev_run.text or "") + "\n"
-                    except Exception:
-                        pass
-            run.text = line or ""
-            # preserve template attributes if present
-            if src_run_sample:
-                try:
-                    copy_font_attrs(src_run_sample, run)
-                except Exception:
-                    pass
-            # apply override_fmt only where template didn't provide the attribute
-            try:
-                apply_fmt_respecting_template(run, override_fmt)
-            except Exception:
-                pass
-            prev_run = run
-
-    # After writing, attempt to normalize paragraph formatting and apply formatting
-    try:
-        for p in text_frame.paragraphs:
-            reset_paragraph_format(p)
-            if align is not None:
-                set_paragraph_alignment(p, align)
-            for r in p.runs:
-                # first, copy template sample run attributes if we had a sample but run lacks attrs
-                try:
-                    if src_run_sample:
-                        # If run has no name/size/bold/etc, copy from sample (copy_font_attrs copies only present attrs on sample)
-                        copy_font_attrs(src_run_sample, r)
-                except Exception:
-                    pass
-                # Then apply override_fmt only where template didn't provide them
-                try:
-                    apply_fmt_respecting_template(r, override_fmt)
-                except Exception:
-                    pass
-    except Exception:
-        pass
+        # (add_br()/add_r() keep the new elements ahead of any <a:endParaRPr>)
+        for i, line in enumerate(lines):
+            if i > 0:
+                a_p.add_br()
+            a_r = a_p.add_r()
+            if rPr is not None:
+                a_r.insert(0, deepcopy(rPr))
+            a_r.t.text = line
 
 def set_text_preserve_shape(shape, text, override_fmt=None, align=None, use_paragraphs=False):
     """
@@ -432,31 +553,22 @@ def set_text_preserve_shape(shape, text, override_fmt=None, align=None, use_para
         sample_run = tf.paragraphs[0].runs[0]
 
     # Zero text-frame margins to remove accidental indentation/padding from template placeholders
-    try:
-        tf.margin_left = Inches(0)
-        tf.margin_right = Inches(0)
-        tf.margin_top = Inches(0)
-        tf.margin_bottom = Inches(0)
-    except Exception:
-        pass
+    _zero_margins(tf)
 
     write_lines_to_textframe_preserve_style(tf, text, src_run_sample=sample_run, override_fmt=override_fmt, align=align, use_paragraphs=use_paragraphs)
 
-def add_marsiya_footer_and_watermark(slide, prs):
-    """Add centered footer and a small red '.' watermark at bottom-right for Marsiya template."""
+def add_marsiya_footer_and_watermark(slide, slide_width, footer_top, footer_height, dot_left, dot_top, dot_size):
+    """
+    Add centered footer and a small red '.' watermark at bottom-right for Marsiya template.
+    Box geometry is the same on every slide, so the caller computes it once per presentation.
+    """
     try:
         # Footer across full width -> center aligned
-        footer_box = slide.shapes.add_textbox(Inches(0), prs.slide_height - Inches(0.6), prs.slide_width, Inches(0.5))
+        footer_box = slide.shapes.add_textbox(_ZERO_IN, footer_top, slide_width, footer_height)
         tf = footer_box.text_frame
         tf.clear()
         # zero margins
-        try:
-            tf.margin_left = Inches(0)
-            tf.margin_right = Inches(0)
-            tf.margin_top = Inches(0)
-            tf.margin_bottom = Inches(0)
-        except Exception:
-            pass
+        _zero_margins(tf)
 
         p = tf.paragraphs[0]
         reset_paragraph_format(p)
@@ -466,35 +578,26 @@ def add_marsiya_footer_and_watermark(slide, prs):
         # apply Calibri 14 bold white
         try:
             r.font.name = "Calibri"
-            r.font.size = Pt(14)
+            r.font.size = _FOOTER_FONT_SIZE
             r.font.bold = True
-            r.font.color.rgb = RGBColor(255, 255, 255)
+            r.font.color.rgb = _WHITE
         except Exception:
             pass
 
         # small red dot on bottom-right as watermark
-        dot_size = Inches(0.25)
-        dot_left = prs.slide_width - dot_size - Inches(0.15)
-        dot_top = prs.slide_height - dot_size - Inches(0.15)
         dot_box = slide.shapes.add_textbox(dot_left, dot_top, dot_size, dot_size)
         tf2 = dot_box.text_frame
         tf2.clear()
-        try:
-            tf2.margin_left = Inches(0)
-            tf2.margin_right = Inches(0)
-            tf2.margin_top = Inches(0)
-            tf2.margin_bottom = Inches(0)
-        except Exception:
-            pass
+        _zero_margins(tf2)
         p2 = tf2.paragraphs[0]
         reset_paragraph_format(p2)
         set_paragraph_alignment(p2, PP_ALIGN.RIGHT)
         r2 = p2.add_run()
         r2.text = "."
         try:
-            r2.font.size = Pt(28)
+            r2.font.size = _DOT_FONT_SIZE
             r2.font.bold = True
-            r2.font.color.rgb = RGBColor(255, 0, 0)
+            r2.font.color.rgb = _RED
         except Exception:
             pass
     except Exception:
@@ -509,9 +612,9 @@ def generate_pptx_from_texts(template_filename, top_block, bottom_block):
     if not os.path.exists(template_path):
         raise FileNotFoundError("Template not found: " + template_path)
 
-    # Keep empty lines (preview maps 1:1)
-    top_lines = [ln.rstrip("\r") for ln in (top_block or "").splitlines()]
-    bottom_lines = [ln.rstrip("\r") for ln in (bottom_block or "").splitlines()]
+    # Keep empty lines (preview maps 1:1); splitlines() already handles \r\n and \r
+    top_lines = (top_block or "").splitlines()
+    bottom_lines = (bottom_block or "").splitlines()
 
     max_len = max(len(top_lines), len(bottom_lines))
     if max_len == 0:
@@ -525,15 +628,8 @@ def generate_pptx_from_texts(template_filename, top_block, bottom_block):
     while len(bottom_lines) < max_len:
         bottom_lines.append("")
 
-    # Load template presentation
-    prs = Presentation(template_path)
-
-    # NEW: normalize placeholders/layouts/slide-master so indent/bullets don't leak in
-    try:
-        normalize_template_placeholders(prs)
-    except Exception:
-        # non-fatal: continue even if normalization fails
-        pass
+    # Load template presentation (cached and already normalized)
+    prs = load_template_presentation(template_path)
 
     # Choose a prototype layout (first slide's layout if available)
     proto_slide = prs.slides[0] if len(prs.slides) > 0 else None
@@ -544,7 +640,7 @@ def generate_pptx_from_texts(template_filename, top_block, bottom_block):
         if not slide:
             return shapes
         for sh in slide.shapes:
-            if hasattr(sh, "text_frame") and sh.text_frame is not None:
+            if sh.has_text_frame:
                 shapes.append(sh)
         try:
             shapes.sort(key=lambda s: s.top)
@@ -555,121 +651,193 @@ def generate_pptx_from_texts(template_filename, top_block, bottom_block):
     proto_text_shapes = get_text_shapes_for_proto(proto_slide)
     use_placeholders = len(proto_text_shapes) >= 2
 
-    # determine format hints
+    # Remove original template first slide up front (only its layout and text shapes were
+    # needed) so exported file doesn't include it; dropping its relationship as well keeps
+    # the orphaned slide part out of the saved package. The remaining slides are renumbered
+    # so the next slide%d.xml partname python-pptx picks (slide count + 1) is free.
+    # A template with no slides has nothing to remove; all generated slides are kept.
+    if proto_slide is not None:
+        try:
+            sldIdLst = prs.slides._sldIdLst  # private API but commonly used
+            del sldIdLst[0]
+            drop_unlisted_slide_rels(prs)
+            prs.part.rename_slide_parts([sldId.rId for sldId in sldIdLst])
+        except Exception:
+            # non-fatal - continue building
+            pass
+
+    # determine format hints (FORMATS keys are lowercase; values were resolved at import)
     base_name = os.path.splitext(template_filename)[0].lower()
-    fmt_key = None
-    for key in FORMATS:
-        if key.lower() == base_name:
-            fmt_key = key
-            break
-    template_formats = FORMATS.get(fmt_key, {})
-
-    # Create slides for each pair
-    for idx in range(max_len):
-        new_slide = prs.slides.add_slide(proto_layout)
+    template_formats = RESOLVED_FORMATS.get(base_name, {})
+    top_fmt = template_formats.get("Top")
+    bottom_fmt = template_formats.get("Bottom")
+    is_marsiya = base_name == "marsiya"
+
+    # Placeholder idx of the (top, bottom) text shapes. Every new slide comes from the same
+    # layout, so they are captured from the first slide's shape scan and later slides look
+    # the placeholders up directly instead of re-scanning and sorting their shapes.
+    ph_idxs = None
+
+    # fallback textbox geometry (used when no placeholders are found), same for every slide;
+    # computed on first use, since placeholder templates may not declare a slide size
+    fallback_geom = None
+
+    # Marsiya footer/watermark geometry, same for every slide:
+    # (slide_width, footer_top, footer_height, dot_left, dot_top, dot_size), or None when no
+    # footer is added (other templates, or no <p:sldSz> to position it against)
+    footer_geom = None
+    slide_width, slide_height = prs.slide_width, prs.slide_height
+    if is_marsiya and slide_width is not None and slide_height is not None:
+        dot_size = Inches(0.25)
+        footer_geom = (
+            slide_width,
+            slide_height - Inches(0.6),
+            Inches(0.5),
+            slide_width - dot_size - Inches(0.15),
+            slide_height - dot_size - Inches(0.15),
+            dot_size,
+        )
+
+    # Create all slides first, so package/slide-list bookkeeping isn't interleaved with
+    # the text writes, then populate each pair
+    slides = prs.slides
+    new_slides = [slides.add_slide(proto_layout) for _ in range(max_len)]
+    for idx, new_slide in enumerate(new_slides):
         top_text = top_lines[idx]
         bottom_text = bottom_lines[idx]
 
         # NEW: reflow bottom_text so every 5 words are on a new line
-        # Combine if bottom_text had embedded newlines (we treat entire phrase)
-        try:
-            joined_bottom = " ".join([ln for ln in bottom_text.splitlines() if ln.strip() != ""])
-            bottom_text_reflowed = break_every_n_words(joined_bottom, n=5)
-        except Exception:
-            bottom_text_reflowed = bottom_text or ""
+        # (break_every_n_words tokenizes on whitespace, so embedded newlines/blank lines
+        # are already joined into one phrase - no separate split/strip/join pass needed)
+        bottom_text_reflowed = break_every_n_words(bottom_text, n=5)
 
         if use_placeholders:
-            new_text_shapes = get_text_shapes_for_proto(new_slide)
-            if len(new_text_shapes) >= 2:
-                top_shape = new_text_shapes[0]
-                bottom_shape = new_text_shapes[-1]
-                # ensure frames have zero margins to avoid leftover indent/padding
+            top_shape = bottom_shape = None
+            if ph_idxs is not None:
                 try:
-                    if top_shape.text_frame:
-                        top_shape.text_frame.margin_left = Inches(0)
-                        top_shape.text_frame.margin_right = Inches(0)
-                        top_shape.text_frame.margin_top = Inches(0)
-                        top_shape.text_frame.margin_bottom = Inches(0)
-                except Exception:
-                    pass
-                try:
-                    if bottom_shape.text_frame:
-                        bottom_shape.text_frame.margin_left = Inches(0)
-                        bottom_shape.text_frame.margin_right = Inches(0)
-                        bottom_shape.text_frame.margin_top = Inches(0)
-                        bottom_shape.text_frame.margin_bottom = Inches(0)
-                except Exception:
-                    pass
+                    top_shape = new_slide.placeholders[ph_idxs[0]]
+                    bottom_shape = new_slide.placeholders[ph_idxs[1]]
+                except KeyError:
+                    top_shape = bottom_shape = None
+            if top_shape is None:
+                # fall back to scanning the slide's text shapes (sorted top to bottom)
+                new_text_shapes = get_text_shapes_for_proto(new_slide)
+                if len(new_text_shapes) >= 2:
+                    top_shape = new_text_shapes[0]
+                    bottom_shape = new_text_shapes[-1]
+                    if ph_idxs is None and top_shape.is_placeholder and bottom_shape.is_placeholder:
+                        idxs = (top_shape.placeholder_format.idx, bottom_shape.placeholder_format.idx)
+                        if idxs[0] != idxs[1]:
+                            ph_idxs = idxs
+            if top_shape is not None:
+                # ensure frames have zero margins to avoid leftover indent/padding
+                _zero_margins(top_shape.text_frame)
+                _zero_margins(bottom_shape.text_frame)
 
                 # Top: preserve prior single-paragraph behavior (centered)
                 # Note: we prefer template attributes (font/size/color/position). override_fmt will only fill missing attrs.
-                set_text_preserve_shape(top_shape, top_text, override_fmt=template_formats.get("Top"), align=PP_ALIGN.CENTER, use_paragraphs=False)
+                set_text_preserve_shape(top_shape, top_text, override_fmt=top_fmt, align=PP_ALIGN.CENTER, use_paragraphs=False)
                 # Bottom: write the reflowed bottom text (every 5 words -> new line) as paragraphs
-                set_text_preserve_shape(bottom_shape, bottom_text_reflowed, override_fmt=template_formats.get("Bottom"), align=PP_ALIGN.LEFT, use_paragraphs=True)
+                set_text_preserve_shape(bottom_shape, bottom_text_reflowed, override_fmt=bottom_fmt, align=PP_ALIGN.LEFT, use_paragraphs=True)
 
                 # If this is marsiya template, add footer + watermark
                 try:
-                    if base_name == "marsiya":
-                        add_marsiya_footer_and_watermark(new_slide, prs)
+                    if footer_geom is not None:
+                        add_marsiya_footer_and_watermark(new_slide, *footer_geom)
                 except Exception:
                     pass
 
                 continue
 
         # fallback textboxes (no placeholders found) - these will use code positioning
-        left = Inches(0.7)
-        top_pos = Inches(0.6)
-        width = prs.slide_width - Inches(1.4)
-
-        top_box = new_slide.shapes.add_textbox(left, top_pos, width, Inches(2.5))
+        if fallback_geom is None:
+            fallback_geom = (Inches(0.7), prs.slide_width - Inches(1.4), Inches(2.5), Inches(0.6), prs.slide_height - Inches(2.8))
+        box_left, box_width, box_height, top_box_top, bottom_box_top = fallback_geom
+        top_box = new_slide.shapes.add_textbox(box_left, top_box_top, box_width, box_height)
         # zero margins on textframe
-        try:
-            top_box.text_frame.margin_left = Inches(0)
-            top_box.text_frame.margin_right = Inches(0)
-            top_box.text_frame.margin_top = Inches(0)
-            top_box.text_frame.margin_bottom = Inches(0)
-        except Exception:
-            pass
+        _zero_margins(top_box.text_frame)
         # write lines (top - single paragraph behavior)
-        write_lines_to_textframe_preserve_style(top_box.text_frame, top_text, src_run_sample=None, override_fmt=template_formats.get("Top"), align=PP_ALIGN.CENTER, use_paragraphs=False)
+        write_lines_to_textframe_preserve_style(top_box.text_frame, top_text, src_run_sample=None, override_fmt=top_fmt, align=PP_ALIGN.CENTER, use_paragraphs=False)
 
-        bottom_top = prs.slide_height - Inches(2.8)
-        bottom_box = new_slide.shapes.add_textbox(left, bottom_top, width, Inches(2.5))
-        try:
-            bottom_box.text_frame.margin_left = Inches(0)
-            bottom_box.text_frame.margin_right = Inches(0)
-            bottom_box.text_frame.margin_top = Inches(0)
-            bottom_box.text_frame.margin_bottom = Inches(0)
-        except Exception:
-            pass
+        bottom_box = new_slide.shapes.add_textbox(box_left, bottom_box_top, box_width, box_height)
+        _zero_margins(bottom_box.text_frame)
         
 
         # write bottom - paragraph per line (works with Google Slides) using reflowed bottom text
-        write_lines_to_textframe_preserve_style(bottom_box.text_frame, bottom_text_reflowed, src_run_sample=None, override_fmt=template_formats.get("Bottom"), align=PP_ALIGN.LEFT, use_paragraphs=True)
+        write_lines_to_textframe_preserve_style(bottom_box.text_frame, bottom_text_reflowed, src_run_sample=None, override_fmt=bottom_fmt, align=PP_ALIGN.LEFT, use_paragraphs=True)
 
         # If this is marsiya template, add footer + watermark
         try:
-            if base_name == "marsiya":
-                add_marsiya_footer_and_watermark(new_slide, prs)
+            if footer_geom is not None:
+                add_marsiya_footer_and_watermark(new_slide, *footer_geom)
         except Exception:
             pass
 
-    # Remove original template first slide so exported file doesn't include the template slide
-    try:
-        sldIdLst = prs.slides._sldIdLst  # private API but commonly used
-        if len(sldIdLst) > 0:
-            sldIdLst.remove(sldIdLst[0])
-    except Exception:
-        # non-fatal - continue to save
-        pass
+    # Save to memory; the route streams this buffer straight back to the client
+    buf = io.BytesIO()
+    prs.save(buf)
+    buf.seek(0)
+    return buf
 
-    out_path = os.path.join(tempfile.gettempdir(), f"export_{uuid.uuid4().hex}.pptx")
-    prs.save(out_path)
-    return out_path
+PPTX_MIMETYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+# -----------------------
+# Worker pool
+# -----------------------
+# Generation is CPU-bound python-pptx/lxml work that holds the GIL, so it runs in worker
+# processes (each keeps its own template cache). The pool is created on first export.
+# Workers are started from a clean forkserver (spawn where that's unavailable) rather than
+# forked from this multi-threaded process, so they never inherit a lock such as
+# _TEMPLATE_CACHE_LOCK that a request thread happened to hold at fork time.
+_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+def get_executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context(_POOL_START_METHOD))
+        return _EXECUTOR
+
+def drop_executor(executor):
+    """Forget executor (if it is still the current pool) so the next call creates a new one."""
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if executor is not None and _EXECUTOR is executor:
+            _EXECUTOR = None
+
+def generate_pptx_bytes(template_filename, top_block, bottom_block):
+    """Worker entry point: generate_pptx_from_texts as raw bytes (cheap to send back)."""
+    return generate_pptx_from_texts(template_filename, top_block, bottom_block).getvalue()
+
+def run_generation(template_filename, top_block, bottom_block):
+    """
+    Generate the deck in the worker pool and return it as a BytesIO.
+    If the pool can't be started (e.g. no POSIX semaphores on this host) or broke
+    (e.g. a worker was killed), this deck is generated in the calling thread instead
+    and the pool is recreated on the next call.
+    """
+    executor = future = None
+    try:
+        executor = get_executor()
+        future = executor.submit(generate_pptx_bytes, template_filename, top_block, bottom_block)
+    except (BrokenProcessPool, OSError, ImportError):
+        drop_executor(executor)
+    if future is not None:
+        try:
+            return io.BytesIO(future.result())
+        except BrokenProcessPool:
+            drop_executor(executor)
+    return io.BytesIO(generate_pptx_bytes(template_filename, top_block, bottom_block))
 
 # -----------------------
 # Filename sanitization helper
 # -----------------------
+# names secure_filename() would return unchanged: ASCII letters/digits/'_'/'.'/'-',
+# not starting or ending with '.' or '_'
+_SAFE_NAME_RE = re.compile(r"[A-Za-z0-9-](?:[A-Za-z0-9_.-]*[A-Za-z0-9-])?")
+
 def make_safe_pptx_filename(raw_name: str, fallback_base: str = "export", max_len: int = 120) -> str:
     """
     Turn a user-provided name into a safe filename. Uses werkzeug.secure_filename
@@ -684,8 +852,12 @@ def make_safe_pptx_filename(raw_name: str, fallback_base: str = "export", max_le
     # remove any path separators just in case
     base = base.replace("/", " ").replace("\\", " ")
 
-    # use secure_filename to remove unsafe characters
-    safe = secure_filename(base)
+    # use secure_filename to remove unsafe characters (skipped for names it would keep as-is;
+    # on Windows it also renames reserved device names, so always run it there)
+    if os.name != "nt" and _SAFE_NAME_RE.fullmatch(base):
+        safe = base
+    else:
+        safe = secure_filename(base)
 
     # fallback if secure_filename produced empty string
     if not safe:
@@ -708,25 +880,9 @@ def make_safe_pptx_filename(raw_name: str, fallback_base: str = "export", max_le
 # -----------------------
 @app.route("/", methods=["GET"])
 def index_route():
-    # available pptx templates (exclude quran)
-    all_pptx = ensure_templates()
-    available_templates = [p for p in all_pptx if os.path.splitext(p)[0].lower() != "quran"]
-
-    # gather images from static/images but exclude quran image
-    images = []
-    images_dir = os.path.join(STATIC_FOLDER, "images")
-    if os.path.isdir(images_dir):
-        for f in sorted(os.listdir(images_dir)):
-            if f.lower().endswith((".png", ".jpg", ".jpeg", ".webp")) and os.path.splitext(f)[0].lower() != "quran":
-                images.append(f)
-
-    # build a mapping image -> matched template filename (if found)
-    image_to_template = {}
-    for img in images:
-        base = os.path.splitext(img)[0]
-        matched = find_matching_template_for_image(base, available_templates)
-        image_to_template[img] = matched
-
+    # available pptx templates and static/images thumbnails (both exclude quran),
+    # plus the image -> template mapping
+    available_templates, images, image_to_template = template_gallery()
     return render_template("index.html", templates=available_templates, images=images, image_to_template=image_to_template)
 
 @app.route("/generate", methods=["POST"])
@@ -742,13 +898,11 @@ def generate_route():
 
     # security: only allow filenames that exist in templates folder (and exclude quran)
     available = ensure_templates()
-    available = [p for p in available if os.path.splitext(p)[0].lower() != "quran"]
-
-    if template_file not in available:
+    if template_file not in available or os.path.splitext(template_file)[0].lower() == "quran":
         abort(400, "Template not available")
 
     try:
-        out_path = generate_pptx_from_texts(template_file, top_text, bottom_text)
+        buf = run_generation(template_file, top_text, bottom_text)
     except Exception as e:
         abort(500, f"Generation error: {e}")
 
@@ -756,12 +910,12 @@ def generate_route():
     fallback_base = os.path.splitext(template_file)[0] + "_export"
     safe_download_name = make_safe_pptx_filename(raw_name or fallback_base, fallback_base=fallback_base)
 
-    # send file with user-chosen safe name
+    # send the in-memory file with user-chosen safe name (Content-Length comes from the BytesIO size)
     try:
-        return send_file(out_path, as_attachment=True, download_name=safe_download_name)
+        return send_file(buf, mimetype=PPTX_MIMETYPE, as_attachment=True, download_name=safe_download_name)
     except TypeError:
         # older Flask versions use 'attachment_filename'
-        return send_file(out_path, as_attachment=True, attachment_filename=safe_download_name)
+        return send_file(buf, mimetype=PPTX_MIMETYPE, as_attachment=True, attachment_filename=safe_download_name)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))